@@ -1,131 +1,426 @@
 from abc import ABC, abstractmethod
-import json
+import asyncio
+from contextvars import ContextVar
 import logging
-from typing import Dict, Optional
+import re
+import time
+from typing import Dict, List, Optional, Tuple
 import os
+import weakref
 
-from openai import OpenAI
+import httpx
+import orjson
+import pydantic
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from openai.types.chat import ChatCompletionChunk
 import anthropic
 import google.generativeai as genai
 
+from ..models.schemas import OfferTemplate
+from .result_handler import Cache
+
 logger = logging.getLogger(__name__)
 
+# The SDKs' default connection pool, with idle TLS connections kept alive between calls
+# for a minute instead of httpx's 5 seconds
+HTTP_LIMITS = httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=60)
+
+# Invalid responses are sent back to the model with the error this many times
+MAX_RETRIES = 2
+
+# Starts the per-run document text in a prompt - everything before it is the same on every
+# call, which lets providers cache that prefix
+DOCUMENTS_HEADER = "OCR Text:\n"
+
+# Async SDK clients opened within the running agather_structured_offers call, by LLM client
+_gather_aclients: ContextVar[Optional[dict]] = ContextVar("_gather_aclients", default=None)
+
 
 class BaseLLMClient(ABC):
-    @abstractmethod
+    provider: str
+    model_name: str
+    cache: Optional[Cache] = None
+    # Async SDK clients by the event loop they were opened on, see _async_client
+    _aclients: Optional[weakref.WeakKeyDictionary] = None
+    
     def get_structured_offer(self, prompt: str) -> dict:
+        """Return the structured offer for a prompt, served from cache when possible"""
+        raw, _ = self.get_structured_offer_raw(prompt)
+        return orjson.loads(raw)
+    
+    def get_structured_offer_raw(self, prompt: str) -> Tuple[bytes, Optional[OfferTemplate]]:
+        """Return the offer's JSON bytes and the OfferTemplate validated from them, or None if it is invalid"""
+        cached = self._get_cached(prompt)
+        if cached is not None:
+            return cached
+        
+        return self._request_offer(prompt)
+    
+    def get_structured_offers(self, prompts: List[str]) -> List[dict]:
+        """Return structured offers for several prompts, one call per uncached prompt"""
+        return [self.get_structured_offer(prompt) for prompt in prompts]
+    
+    async def aget_structured_offer(self, prompt: str) -> dict:
+        """Async variant of get_structured_offer"""
+        raw, _ = await self.aget_structured_offer_raw(prompt)
+        return orjson.loads(raw)
+    
+    async def aget_structured_offer_raw(self, prompt: str) -> Tuple[bytes, Optional[OfferTemplate]]:
+        """Async variant of get_structured_offer_raw"""
+        cached = self._get_cached(prompt)
+        if cached is not None:
+            return cached
+        
+        return await self._arequest_offer(prompt)
+    
+    async def agather_structured_offers(self, prompts: List[str]) -> List[dict]:
+        """Request offers for several prompts concurrently, at most LLM_CONCURRENCY at a time"""
+        semaphore = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "4")))
+        
+        async def request_one(prompt: str) -> dict:
+            async with semaphore:
+                return await self.aget_structured_offer(prompt)
+        
+        # The requests share the clients opened by this call, which closes them when done
+        opened = {}
+        token = _gather_aclients.set(opened)
+        try:
+            return await asyncio.gather(*(request_one(prompt) for prompt in prompts))
+        finally:
+            _gather_aclients.reset(token)
+            for client in opened.values():
+                await client.close()
+    
+    async def aclose(self):
+        """Close the async SDK client that aget_structured_offer opened on the running event loop"""
+        if self._aclients:
+            client = self._aclients.pop(asyncio.get_running_loop(), None)
+            if client is not None:
+                await client.close()
+    
+    @abstractmethod
+    def _complete(self, messages: List[dict]) -> str:
+        """Send a user/assistant conversation to the provider and return the streamed reply text"""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def _acomplete(self, messages: List[dict]) -> str:
         raise NotImplementedError
+    
+    def _extract_json(self, result: str) -> str:
+        """Return the JSON document in a reply"""
+        return result
+    
+    def _request_offer(self, prompt: str) -> Tuple[bytes, Optional[OfferTemplate]]:
+        """Request an offer, sending parse and validation errors back to the model for a fix"""
+        messages = [{"role": "user", "content": prompt}]
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(1.0 * attempt)
+            
+            offer = self._accept_offer(prompt, self._complete(messages), messages, attempt)
+            if offer is not None:
+                return offer
+    
+    async def _arequest_offer(self, prompt: str) -> Tuple[bytes, Optional[OfferTemplate]]:
+        """Async variant of _request_offer"""
+        messages = [{"role": "user", "content": prompt}]
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(1.0 * attempt)
+            
+            offer = self._accept_offer(prompt, await self._acomplete(messages), messages, attempt)
+            if offer is not None:
+                return offer
+    
+    def _accept_offer(self, prompt: str, result: str, messages: List[dict],
+                      attempt: int) -> Optional[Tuple[bytes, Optional[OfferTemplate]]]:
+        """Validate a reply; on failure queue the error as feedback and return None"""
+        raw = self._extract_json(result).encode('utf-8')
+        
+        try:
+            # Parses and validates in one pass - malformed JSON is a ValidationError too
+            offer = OfferTemplate.model_validate_json(raw)
+        except pydantic.ValidationError as e:
+            if attempt == MAX_RETRIES:
+                # Hand the invalid offer back - the orchestrator reports it and saves it for debugging
+                return raw, None
+            error = e
+        else:
+            self._put_cached(prompt, raw)
+            return raw, offer
+        
+        logger.warning(f"Invalid response from {self.provider} (attempt {attempt + 1} of {MAX_RETRIES + 1}): {error}")
+        messages.append({"role": "assistant", "content": result})
+        messages.append({"role": "user", "content": f"Your output had error: {error}. Fix and return valid JSON."})
+        return None
+    
+    def _async_client(self):
+        """Return the async SDK client of the current gather call or event loop, opening it on first use"""
+        opened = _gather_aclients.get()
+        if opened is not None:
+            key = self
+        else:
+            # Async connections belong to the event loop that opened them, so each loop gets its own client
+            if self._aclients is None:
+                self._aclients = weakref.WeakKeyDictionary()
+            opened, key = self._aclients, asyncio.get_running_loop()
+        
+        client = opened.get(key)
+        if client is None:
+            client = opened[key] = self._create_async_client()
+        return client
+    
+    def _create_async_client(self):
+        raise NotImplementedError
+    
+    def _cache_key(self, prompt: str) -> str:
+        return Cache.make_key(prompt.encode('utf-8'), self.provider, self.model_name)
+    
+    def _get_cached(self, prompt: str) -> Optional[Tuple[bytes, OfferTemplate]]:
+        """Return a cached reply and its validated offer; unusable entries are dropped as misses"""
+        if self.cache is None:
+            return None
+        
+        key = self._cache_key(prompt)
+        cached = self.cache.get_raw(key)
+        if cached is None:
+            return None
+        
+        try:
+            offer = OfferTemplate.model_validate_json(cached)
+        except pydantic.ValidationError:
+            logger.warning(f"Discarding corrupt cached {self.provider} response")
+            self.cache.delete(key)
+            return None
+        
+        logger.info(f"Using cached {self.provider} response")
+        return cached, offer
+    
+    def _put_cached(self, prompt: str, result: bytes):
+        if self.cache is not None:
+            self.cache.put_raw(self._cache_key(prompt), result)
 
 
 class OpenAIClient(BaseLLMClient):
-    def __init__(self, api_key: str, model: str = "gpt-4-turbo"):
-        self.client = OpenAI(api_key=api_key)
+    provider = "openai"
+    
+    def __init__(self, api_key: str, model: str = "gpt-4-turbo", cache: Optional[Cache] = None):
+        self.client = OpenAI(api_key=api_key, http_client=DefaultHttpxClient(limits=HTTP_LIMITS))
         self.model = model
+        self.model_name = model
+        self.cache = cache
         logger.info(f"Initialized OpenAI client with model: {model}")
     
-    def get_structured_offer(self, prompt: str) -> dict:
-        """Call OpenAI API and return structured response"""
+    def _create_async_client(self) -> AsyncOpenAI:
+        return AsyncOpenAI(api_key=self.client.api_key, http_client=DefaultAsyncHttpxClient(limits=HTTP_LIMITS))
+    
+    def _completion_params(self, messages: List[dict]) -> dict:
+        return dict(
+            model=self.model,
+            messages=messages,
+            temperature=0.1,  # Low temperature for more consistent extraction
+            response_format={"type": "json_object"},  # Force JSON response
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    
+    def _read_stream(self, chunk: ChatCompletionChunk, parts: List[str]):
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+        if chunk.usage:
+            # Prompts share the instructions and schema prefix, which OpenAI caches automatically
+            details = chunk.usage.prompt_tokens_details
+            cached_tokens = details.cached_tokens if details else 0
+            logger.debug(f"OpenAI prompt tokens: {chunk.usage.prompt_tokens} ({cached_tokens} cached)")
+    
+    def _complete(self, messages: List[dict]) -> str:
+        """Call OpenAI API and return the response text"""
         logger.info("Calling OpenAI API...")
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,  # Low temperature for more consistent extraction
-                response_format={"type": "json_object"}  # Force JSON response
-            )
+            parts = []
+            for chunk in self.client.chat.completions.create(**self._completion_params(messages)):
+                self._read_stream(chunk, parts)
             
-            result = response.choices[0].message.content
             logger.debug(f"Received response from OpenAI")
+            return "".join(parts)
+        
+        except Exception as e:
+            logger.error(f"Error calling OpenAI API: {str(e)}")
+            raise
+    
+    async def _acomplete(self, messages: List[dict]) -> str:
+        """Call OpenAI API asynchronously and return the response text"""
+        logger.info("Calling OpenAI API...")
+        
+        try:
+            client = self._async_client()
+            parts = []
+            async for chunk in await client.chat.completions.create(**self._completion_params(messages)):
+                self._read_stream(chunk, parts)
             
-            # Parse JSON response
-            return json.loads(result)
-            
+            logger.debug(f"Received response from OpenAI")
+            return "".join(parts)
+        
         except Exception as e:
             logger.error(f"Error calling OpenAI API: {str(e)}")
             raise
 
 
 class ClaudeClient(BaseLLMClient):
-    def __init__(self, api_key: str, model: str = "claude-3-opus-20240229"):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    provider = "claude"
+    
+    def __init__(self, api_key: str, model: str = "claude-3-opus-20240229", cache: Optional[Cache] = None):
+        self.client = anthropic.Anthropic(api_key=api_key, http_client=anthropic.DefaultHttpxClient(limits=HTTP_LIMITS))
         self.model = model
+        self.model_name = model
+        self.cache = cache
         logger.info(f"Initialized Claude client with model: {model}")
     
-    def get_structured_offer(self, prompt: str) -> dict:
-        """Call Claude API and return structured response"""
+    def _create_async_client(self) -> anthropic.AsyncAnthropic:
+        return anthropic.AsyncAnthropic(api_key=self.client.api_key,
+                                        http_client=anthropic.DefaultAsyncHttpxClient(limits=HTTP_LIMITS))
+    
+    def _message_params(self, messages: List[dict]) -> dict:
+        # Mark the static instructions and schema as a cacheable prefix of the prompt
+        prefix, header, documents = messages[0]["content"].partition(DOCUMENTS_HEADER)
+        if header:
+            first_message = {"role": "user", "content": [
+                {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": header + documents}
+            ]}
+            messages = [first_message] + messages[1:]
+        
+        return dict(
+            model=self.model,
+            max_tokens=4096,
+            temperature=0.1,
+            messages=messages
+        )
+    
+    def _log_usage(self, usage: anthropic.types.Usage):
+        logger.debug(f"Claude input tokens: {usage.input_tokens} "
+                     f"({usage.cache_read_input_tokens or 0} read from cache, "
+                     f"{usage.cache_creation_input_tokens or 0} written to cache)")
+    
+    def _complete(self, messages: List[dict]) -> str:
+        """Call Claude API and return the response text"""
         logger.info("Calling Claude API...")
         
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=4096,
-                temperature=0.1,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            with self.client.messages.stream(**self._message_params(messages)) as stream:
+                chunks = list(stream.text_stream)
+                self._log_usage(stream.get_final_message().usage)
             
-            result = response.content[0].text
             logger.debug(f"Received response from Claude")
+            return "".join(chunks)
+        
+        except Exception as e:
+            logger.error(f"Error calling Claude API: {str(e)}")
+            raise
+    
+    async def _acomplete(self, messages: List[dict]) -> str:
+        """Call Claude API asynchronously and return the response text"""
+        logger.info("Calling Claude API...")
+        
+        try:
+            client = self._async_client()
+            async with client.messages.stream(**self._message_params(messages)) as stream:
+                chunks = [text async for text in stream.text_stream]
+                self._log_usage((await stream.get_final_message()).usage)
             
-            # Parse JSON response
-            return json.loads(result)
-            
+            logger.debug(f"Received response from Claude")
+            return "".join(chunks)
+        
         except Exception as e:
             logger.error(f"Error calling Claude API: {str(e)}")
             raise
 
 
+# A ```json ... ``` markdown fence around a whole response, in any case and with surrounding whitespace
+_JSON_FENCE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.S | re.I)
+
+
 class GeminiClient(BaseLLMClient):
-    def __init__(self, api_key: str, model: str = "gemini-pro"):
+    provider = "gemini"
+    
+    def __init__(self, api_key: str, model: str = "gemini-pro", cache: Optional[Cache] = None):
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model)
+        self.model_name = model
+        self.cache = cache
         logger.info(f"Initialized Gemini client with model: {model}")
     
-    def get_structured_offer(self, prompt: str) -> dict:
-        """Call Gemini API and return structured response"""
+    def _complete(self, messages: List[dict]) -> str:
+        """Call Gemini API and return the response text"""
         logger.info("Calling Gemini API...")
         
         try:
-            # Configure generation parameters for JSON output
-            generation_config = genai.GenerationConfig(
-                temperature=0.1,
-                candidate_count=1,
-            )
-            
             # The prompt already contains all instructions from prompt_template.md
-            
             response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
+                self._contents(messages),
+                generation_config=self._generation_config(),
+                stream=True
             )
+            chunks = [chunk.text for chunk in response]
             
-            result = response.text
             logger.debug(f"Received response from Gemini")
+            return "".join(chunks)
+        
+        except Exception as e:
+            logger.error(f"Error calling Gemini API: {str(e)}")
+            raise
+    
+    async def _acomplete(self, messages: List[dict]) -> str:
+        """Call Gemini API asynchronously and return the response text"""
+        logger.info("Calling Gemini API...")
+        
+        try:
+            response = await self.model.generate_content_async(
+                self._contents(messages),
+                generation_config=self._generation_config(),
+                stream=True
+            )
+            chunks = [chunk.text async for chunk in response]
             
-            # Clean up response if needed (Gemini sometimes adds markdown)
-            if result.startswith("```json"):
-                result = result[7:]  # Remove ```json
-            if result.endswith("```"):
-                result = result[:-3]  # Remove ```
-            
-            # Parse JSON response
-            return json.loads(result.strip())
-            
+            logger.debug(f"Received response from Gemini")
+            return "".join(chunks)
+        
         except Exception as e:
             logger.error(f"Error calling Gemini API: {str(e)}")
             raise
+    
+    def _contents(self, messages: List[dict]) -> List[dict]:
+        # Gemini calls the assistant role "model"
+        return [
+            {"role": "model" if message["role"] == "assistant" else "user", "parts": [message["content"]]}
+            for message in messages
+        ]
+    
+    def _generation_config(self) -> genai.GenerationConfig:
+        # Configure generation parameters for JSON output
+        return genai.GenerationConfig(
+            temperature=0.1,
+            candidate_count=1,
+        )
+    
+    def _extract_json(self, result: str) -> str:
+        # Clean up response if needed (Gemini sometimes adds markdown)
+        fenced = _JSON_FENCE.match(result)
+        return fenced.group(1) if fenced else result
 
 
 class LLMClientFactory:
     """Factory for creating LLM clients"""
     
-    @staticmethod
-    def create_client(provider: str, api_key: Optional[str] = None) -> BaseLLMClient:
-        """Create an LLM client based on provider name"""
+    # Process-wide client instances, so HTTP connection pools are reused between calls
+    _clients: Dict[tuple, BaseLLMClient] = {}
+    
+    @classmethod
+    def create_client(cls, provider: str, api_key: Optional[str] = None, model: Optional[str] = None,
+                      cache: Optional[Cache] = None) -> BaseLLMClient:
+        """Return the LLM client for a provider, creating it on first use"""
         
         # Get API key from environment if not provided
         if not api_key:
@@ -139,11 +434,25 @@ class LLMClientFactory:
         if not api_key:
             raise ValueError(f"API key not provided for {provider}")
         
+        # Callers with different caches get different clients - the cache is not shared state
+        key = (provider, model, api_key, str(cache.cache_dir.resolve()) if cache else None)
+        client = cls._clients.get(key)
+        if client is None:
+            client = cls._build_client(provider, api_key, model, cache)
+            cls._clients[key] = client
+        
+        return client
+    
+    @staticmethod
+    def _build_client(provider: str, api_key: str, model: Optional[str], cache: Optional[Cache]) -> BaseLLMClient:
+        """Instantiate a new LLM client, using the provider's default model unless given"""
+        kwargs = {"model": model} if model else {}
+        
         if provider == "openai":
-            return OpenAIClient(api_key)
+            return OpenAIClient(api_key, cache=cache, **kwargs)
         elif provider == "claude":
-            return ClaudeClient(api_key)
+            return ClaudeClient(api_key, cache=cache, **kwargs)
         elif provider == "gemini":
-            return GeminiClient(api_key)
+            return GeminiClient(api_key, cache=cache, **kwargs)
         else:
             raise ValueError(f"Unknown LLM provider: {provider}")
\ No newline at end of file
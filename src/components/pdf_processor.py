@@ -1,53 +1,117 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
-from typing import List
+import os
+import threading
+from typing import Optional, Tuple
+
+# Keep Tesseract's OpenMP single-threaded so concurrent pages don't oversubscribe.
+# libgomp reads this when it is loaded, so it has to be set before importing tesserocr.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import fitz  # PyMuPDF
-from PIL import Image
-import pytesseract
-import io
+from tesserocr import OEM, PyTessBaseAPI
 
 from ..models.schemas import ExtractedFile, ExtractedPage
+from .result_handler import Cache
 
 logger = logging.getLogger(__name__)
 
+# Open PDFs shared by the extraction strategies, keyed by (path, mtime), least recently used first
+_open_documents: "OrderedDict[tuple, fitz.Document]" = OrderedDict()
+MAX_OPEN_DOCUMENTS = 8
+
+
+def _open_pdf(file_path: str) -> fitz.Document:
+    """Return an open document for file_path, reusing it while the file is unchanged"""
+    path = os.path.abspath(file_path)
+    key = (path, os.path.getmtime(path))
+    
+    pdf_document = _open_documents.pop(key, None)
+    if pdf_document is None or pdf_document.is_closed:
+        pdf_document = fitz.open(path)
+    _open_documents[key] = pdf_document
+    
+    # Close evicted documents explicitly so file handles don't pile up
+    while len(_open_documents) > MAX_OPEN_DOCUMENTS:
+        _, evicted = _open_documents.popitem(last=False)
+        evicted.close()
+    
+    return pdf_document
+
 
 class BaseExtractionStrategy(ABC):
+    # Identifies the strategy and its settings in extraction cache keys
+    cache_tag: str
+    
     @abstractmethod
     def extract(self, file_path: str) -> ExtractedFile:
         raise NotImplementedError
 
 
+# One warm Tesseract API per OCR thread - language data is loaded once, not per page
+_tesseract = threading.local()
+_ocr_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _ocr_concurrency() -> int:
+    return int(os.getenv("OCR_CONCURRENCY", os.cpu_count() or 1))
+
+
+def _get_ocr_executor() -> ThreadPoolExecutor:
+    """Return the process-wide OCR thread pool, keeping its Tesseract APIs alive between files"""
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ThreadPoolExecutor(max_workers=_ocr_concurrency(), thread_name_prefix="ocr")
+    return _ocr_executor
+
+
+def _ocr_image(image: Tuple[bytes, int, int, int, int], lang: str, dpi: int) -> str:
+    """Recognize raw (samples, width, height, bytes per pixel, bytes per line) with this thread's Tesseract API"""
+    api = getattr(_tesseract, "api", None)
+    if api is None:
+        api = _tesseract.api = PyTessBaseAPI(lang=lang, oem=OEM.LSTM_ONLY)
+    
+    # Raw samples - no image encode/decode round-trip
+    api.SetImageBytes(*image)
+    api.SetSourceResolution(dpi)
+    return api.GetUTF8Text()
+
+
 class OCRExtractionStrategy(BaseExtractionStrategy):
+    def __init__(self, dpi: int = 150):
+        self.dpi = dpi
+        self.cache_tag = f"ocr-lstm@{dpi}dpi"
+    
+    def _render_page(self, page) -> Tuple[bytes, int, int, int, int]:
+        """Render a PDF page to raw grayscale samples and their layout"""
+        # Tesseract binarizes anyway - grayscale is a third of the RGB data
+        pix = page.get_pixmap(dpi=self.dpi, colorspace=fitz.csGRAY)
+        # Only plain bytes and ints leave this thread - the pixmap is read and freed here
+        return pix.samples, pix.width, pix.height, pix.n, pix.stride
+    
     def extract(self, file_path: str) -> ExtractedFile:
-        """Extract text from PDF using OCR (pytesseract and Pillow)"""
+        """Extract text from PDF using OCR (tesserocr)"""
         logger.info(f"Extracting text from {file_path} using OCR")
         
-        pages = []
-        pdf_document = fitz.open(file_path)
+        pdf_document = _open_pdf(file_path)
+        executor = _get_ocr_executor()
+        window = _ocr_concurrency()
         
-        try:
-            for page_num in range(len(pdf_document)):
-                page = pdf_document[page_num]
-                
-                # Convert page to image
-                mat = fitz.Matrix(2, 2)  # 2x scaling for better OCR quality
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.pil_tobytes(format="PNG")
-                image = Image.open(io.BytesIO(img_data))
-                
-                # Perform OCR
-                text = pytesseract.image_to_string(image, lang='pol')  # Polish language
-                
-                pages.append(ExtractedPage(
-                    page_number=page_num + 1,
-                    content=text
-                ))
-                
-                logger.debug(f"Extracted page {page_num + 1} using OCR")
-                
-        finally:
-            pdf_document.close()
+        # Pages are rendered here (PyMuPDF is not thread-safe) and only their samples are recognized in the pool.
+        # At most `window` rendered pages are in flight, so rasters don't pile up in memory.
+        texts = []
+        pending = deque()
+        for page in pdf_document:
+            if len(pending) >= window:
+                texts.append(pending.popleft().result())
+            pending.append(executor.submit(_ocr_image, self._render_page(page), 'pol', self.dpi))
+        texts.extend(future.result() for future in pending)
+        
+        pages = [ExtractedPage(page_number=page_num, content=text) for page_num, text in enumerate(texts, 1)]
+        logger.debug(f"Extracted {len(pages)} pages using OCR")
         
         return ExtractedFile(
             filename=Path(file_path).name,
@@ -56,28 +120,27 @@ class OCRExtractionStrategy(BaseExtractionStrategy):
         )
 
 
+# Plain text extraction without image blocks and with ligatures expanded to plain letters
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES & ~fitz.TEXT_PRESERVE_LIGATURES
+
+
 class TextLayerExtractionStrategy(BaseExtractionStrategy):
+    cache_tag = "text-nolig"  # Bumped when TEXT_FLAGS changed the extracted text
+    
     def extract(self, file_path: str) -> ExtractedFile:
         """Extract text from PDF using text layer (PyMuPDF/fitz)"""
         logger.info(f"Extracting text from {file_path} using text layer")
         
-        pages = []
-        pdf_document = fitz.open(file_path)
+        pdf_document = _open_pdf(file_path)
+        pages = [None] * len(pdf_document)
         
-        try:
-            for page_num in range(len(pdf_document)):
-                page = pdf_document[page_num]
-                text = page.get_text()
-                
-                pages.append(ExtractedPage(
-                    page_number=page_num + 1,
-                    content=text
-                ))
-                
-                logger.debug(f"Extracted page {page_num + 1} using text layer")
-                
-        finally:
-            pdf_document.close()
+        for page_num, page in enumerate(pdf_document):
+            pages[page_num] = ExtractedPage(
+                page_number=page_num + 1,
+                content=page.get_text("text", flags=TEXT_FLAGS)
+            )
+            
+            logger.debug(f"Extracted page {page_num + 1} using text layer")
         
         return ExtractedFile(
             filename=Path(file_path).name,
@@ -89,7 +152,8 @@ class TextLayerExtractionStrategy(BaseExtractionStrategy):
 class PDFProcessor:
     """Factory class for PDF processing strategies"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[Cache] = None):
+        self.cache = cache
         self.strategies = {
             'ocr': OCRExtractionStrategy(),
             'text': TextLayerExtractionStrategy()
@@ -101,4 +165,53 @@ class PDFProcessor:
             raise ValueError(f"Unknown extraction method: {method}")
         
         strategy = self.strategies[method]
-        return strategy.extract(file_path)
\ No newline at end of file
+        if self.cache is None:
+            return strategy.extract(file_path)
+        
+        # Extraction is deterministic given the PDF bytes and the strategy settings
+        key = Cache.make_key(Path(file_path).read_bytes(), strategy.cache_tag)
+        cached = self._get_cached(key, file_path)
+        if cached is not None:
+            return cached
+        
+        extracted_file = strategy.extract(file_path)
+        self.cache.put(key, extracted_file)  # orjson serializes dataclasses natively
+        return extracted_file
+    
+    def _get_cached(self, key: str, file_path: str) -> Optional[ExtractedFile]:
+        """Return a cached extraction; unusable entries are dropped as misses"""
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        
+        try:
+            # The same content may be cached under a different filename
+            extracted_file = ExtractedFile(
+                filename=Path(file_path).name,
+                extraction_method=cached['extraction_method'],
+                pages=[ExtractedPage(**page) for page in cached['pages']]
+            )
+        except (KeyError, TypeError):
+            logger.warning(f"Discarding corrupt cached extraction for {file_path}")
+            self.cache.delete(key)
+            return None
+        
+        logger.info(f"Using cached extraction for {file_path}")
+        return extracted_file
+
+
+# PDF processor of an extraction worker process, see init_extraction_worker
+_worker_pdf_processor: Optional[PDFProcessor] = None
+
+
+def init_extraction_worker(cache_dir: Optional[str], ocr_concurrency: int):
+    """Set up a worker process for parallel PDF extraction"""
+    global _worker_pdf_processor
+    
+    # Split the cores between workers rather than letting each one OCR cpu_count pages at once
+    os.environ.setdefault("OCR_CONCURRENCY", str(ocr_concurrency))
+    _worker_pdf_processor = PDFProcessor(cache=Cache(cache_dir) if cache_dir else None)
+
+
+def extract_in_worker(file_path: str, extraction_method: str) -> ExtractedFile:
+    return _worker_pdf_processor.extract(file_path, extraction_method)
\ No newline at end of file
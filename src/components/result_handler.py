@@ -1,19 +1,81 @@
-import json
+import hashlib
 import logging
+import os
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Any
+import orjson
 
 from ..models.schemas import FinalResult, OfferTemplate
 
 logger = logging.getLogger(__name__)
 
 
+class Cache:
+    """Content-addressable disk cache of JSON documents stored as <cache_dir>/<key>.json"""
+    
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+    
+    @staticmethod
+    def make_key(data: bytes, *parts: str) -> str:
+        """Build a cache key from the SHA-256 of the content and its configuration"""
+        digest = hashlib.sha256(data)
+        for part in parts:
+            digest.update(b"\0" + part.encode('utf-8'))
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached document for key, or None on a miss"""
+        file_path = self.cache_dir / f"{key}.json"
+        try:
+            return orjson.loads(file_path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except orjson.JSONDecodeError:
+            logger.warning(f"Ignoring corrupt cache entry {file_path}")
+            return None
+    
+    def get_raw(self, key: str) -> Optional[bytes]:
+        """Return the cached document for key as stored JSON bytes, or None on a miss"""
+        try:
+            return (self.cache_dir / f"{key}.json").read_bytes()
+        except FileNotFoundError:
+            return None
+    
+    def delete(self, key: str):
+        """Remove the entry for key, if any"""
+        (self.cache_dir / f"{key}.json").unlink(missing_ok=True)
+    
+    def put(self, key: str, obj: Any):
+        """Store a JSON-serializable document under key"""
+        self.put_raw(key, orjson.dumps(obj))
+    
+    def put_raw(self, key: str, data: bytes):
+        """Store an already serialized JSON document under key"""
+        file_path = self.cache_dir / f"{key}.json"
+        tmp_path = file_path.with_suffix(f".{os.getpid()}.tmp")
+        
+        tmp_path.write_bytes(data)
+        
+        # Atomic rename so concurrent runs never read a partial entry
+        os.replace(tmp_path, file_path)
+        logger.debug(f"Cached {file_path}")
+
+
 class ResultHandler:
-    """Handles validation and saving of results"""
+    """Handles validation and saving of results - create one handler per run, its files share the run's timestamp"""
     
-    def __init__(self):
+    def __init__(self, output_folder: Optional[str] = None):
         self.logger = logging.getLogger(__name__)
+        
+        # Output files of one handler share a folder and a run timestamp, so a handler
+        # reused for a second run would overwrite the first run's files
+        self.output_path = Path(output_folder) if output_folder else None
+        if self.output_path:
+            self.output_path.mkdir(parents=True, exist_ok=True)
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
     def validate_offer(self, offer_data: dict) -> OfferTemplate:
         """Validate offer data against the OfferTemplate schema"""
@@ -23,81 +85,61 @@ class ResultHandler:
             self.logger.error(f"Offer validation failed: {str(e)}")
             raise
     
-    def save_offer(self, offer: OfferTemplate, output_folder: str, filename_prefix: str = "filled_offer") -> Path:
+    def save_offer(self, offer: OfferTemplate, *, filename_prefix: str = "filled_offer") -> Path:
         """Save the filled offer to JSON file"""
-        output_path = Path(output_folder)
-        output_path.mkdir(parents=True, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{filename_prefix}_{timestamp}.json"
-        file_path = output_path / filename
+        file_path = self._output_file(f"{filename_prefix}_{self.timestamp}.json")
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(offer.model_dump(), f, ensure_ascii=False, indent=2)
+        file_path.write_text(offer.model_dump_json(indent=2), encoding='utf-8')
         
         self.logger.info(f"Saved offer to {file_path}")
         return file_path
     
-    def save_complete_result(self, result: FinalResult, output_folder: str) -> Path:
+    def save_complete_result(self, result: FinalResult) -> Path:
         """Save the complete result including metadata"""
-        output_path = Path(output_folder)
-        output_path.mkdir(parents=True, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"complete_result_{timestamp}.json"
-        file_path = output_path / filename
+        file_path = self._output_file(f"complete_result_{self.timestamp}.json")
         
-        # Convert datetime to string for JSON serialization
-        result_dict = result.model_dump()
-        result_dict['processing_timestamp'] = result.processing_timestamp.isoformat()
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(result_dict, f, ensure_ascii=False, indent=2)
+        file_path.write_text(result.model_dump_json(indent=2), encoding='utf-8')
         
         self.logger.debug(f"Saved complete result to {file_path}")
         return file_path
     
-    def save_failed_response(self, response: Any, output_folder: str, error: Optional[Exception] = None) -> Path:
+    def save_failed_response(self, response: Any, *, error: Optional[Exception] = None) -> Path:
         """Save failed LLM response for debugging"""
-        output_path = Path(output_folder)
-        output_path.mkdir(parents=True, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"failed_response_{timestamp}.json"
-        file_path = output_path / filename
+        file_path = self._output_file(f"failed_response_{self.timestamp}.json")
         
         error_data = {
-            "timestamp": timestamp,
+            "timestamp": self.timestamp,
             "error": str(error) if error else "Unknown error",
             "response": response if isinstance(response, dict) else str(response)
         }
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(error_data, f, ensure_ascii=False, indent=2)
+        file_path.write_bytes(orjson.dumps(error_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         
         self.logger.info(f"Saved failed response to {file_path}")
         return file_path
     
-    def save_extracted_files(self, extracted_files: list, output_folder: str):
+    def save_extracted_files(self, extracted_files: list):
         """Save intermediate extracted files"""
-        output_path = Path(output_folder)
-        output_path.mkdir(parents=True, exist_ok=True)
+        file_paths = [self._output_file(f"{Path(ef.filename).stem}_extracted.json") for ef in extracted_files]
         
-        for extracted_file in extracted_files:
-            filename = f"{Path(extracted_file.filename).stem}_extracted.json"
-            file_path = output_path / filename
-            
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(extracted_file.model_dump(), f, ensure_ascii=False, indent=2)
+        for extracted_file, file_path in zip(extracted_files, file_paths):
+            file_path.write_bytes(orjson.dumps(extracted_file, option=orjson.OPT_INDENT_2))
             
             self.logger.debug(f"Saved extracted data to {file_path}")
     
+    def _output_file(self, filename: str) -> Path:
+        if self.output_path is None:
+            raise ValueError("ResultHandler was created without an output folder")
+        return self.output_path / filename
+    
     def load_offer_from_file(self, file_path: str) -> OfferTemplate:
         """Load and validate an offer from a JSON file"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        return self.validate_offer(data)
+        # Parse and validate in one pass, without building an intermediate dict
+        try:
+            return OfferTemplate.model_validate_json(Path(file_path).read_bytes())
+        except Exception as e:
+            self.logger.error(f"Offer validation failed: {str(e)}")
+            raise
     
     def compare_offers(self, offer1: OfferTemplate, offer2: OfferTemplate) -> dict:
         """Compare two offers and return differences"""
@@ -109,23 +151,26 @@ class ResultHandler:
         
         return differences
     
-    def _compare_dicts(self, d1: dict, d2: dict, differences: dict, path: str = ""):
-        """Recursively compare two dictionaries"""
-        all_keys = set(d1.keys()) | set(d2.keys())
+    def _compare_dicts(self, d1: dict, d2: dict, differences: dict):
+        """Compare two nested dictionaries, walking sub-dictionaries with an explicit stack"""
+        stack = [(d1, d2, "")]
         
-        for key in all_keys:
-            current_path = f"{path}.{key}" if path else key
+        while stack:
+            d1, d2, path = stack.pop()
             
-            if key not in d1:
-                differences[current_path] = {"status": "added", "value": d2[key]}
-            elif key not in d2:
-                differences[current_path] = {"status": "removed", "value": d1[key]}
-            elif d1[key] != d2[key]:
-                if isinstance(d1[key], dict) and isinstance(d2[key], dict):
-                    self._compare_dicts(d1[key], d2[key], differences, current_path)
-                else:
-                    differences[current_path] = {
-                        "status": "changed",
-                        "old_value": d1[key],
-                        "new_value": d2[key]
-                    }
\ No newline at end of file
+            for key in d1.keys() | d2.keys():
+                current_path = f"{path}.{key}" if path else key
+                
+                if key not in d1:
+                    differences[current_path] = {"status": "added", "value": d2[key]}
+                elif key not in d2:
+                    differences[current_path] = {"status": "removed", "value": d1[key]}
+                elif d1[key] != d2[key]:
+                    if isinstance(d1[key], dict) and isinstance(d2[key], dict):
+                        stack.append((d1[key], d2[key], current_path))
+                    else:
+                        differences[current_path] = {
+                            "status": "changed",
+                            "old_value": d1[key],
+                            "new_value": d2[key]
+                        }
\ No newline at end of file
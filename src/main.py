@@ -6,8 +6,6 @@ import typer
 from typing import Optional
 from dotenv import load_dotenv
 
-from .orchestrator import WorkflowOrchestrator
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -46,6 +44,21 @@ def process(
         "--llm-provider", "-p",
         help="LLM provider to use: 'openai', 'claude', or 'gemini'"
     ),
+    cache_dir: Optional[str] = typer.Option(
+        None,
+        "--cache-dir", "-c",
+        help="Folder for caching extraction and LLM results between runs (default: $OFFER_CACHE_DIR)"
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers", "-w",
+        help="Number of PDF files to extract in parallel (default: CPU count for OCR, one at a time for text)"
+    ),
+    debug_dump: bool = typer.Option(
+        False,
+        "--debug-dump",
+        help="Also save the complete result with the prompt and raw LLM response"
+    ),
     verbose: bool = typer.Option(
         False,
         "--verbose", "-v",
@@ -84,6 +97,10 @@ def process(
     # Load environment variables
     load_dotenv()
     
+    # Imported here, not at module level - extraction worker processes re-import this
+    # module, and the orchestrator pulls in every LLM SDK
+    from .orchestrator import WorkflowOrchestrator
+    
     try:
         # Create and run orchestrator
         typer.echo(f"Starting processing...")
@@ -92,7 +109,11 @@ def process(
         typer.echo(f"Extraction method: {extraction_method}")
         typer.echo(f"LLM provider: {llm_provider}")
         
-        orchestrator = WorkflowOrchestrator()
+        orchestrator = WorkflowOrchestrator(config={
+            'cache_dir': cache_dir,
+            'max_workers': workers,
+            'debug_dump': debug_dump
+        })
         orchestrator.run(
             input_folder=input_folder,
             output_folder=output_folder,
@@ -134,9 +155,9 @@ def validate(
         handler = ResultHandler()
         offer = handler.load_offer_from_file(offer_file)
         typer.echo(f" Valid offer file: {offer_file}")
-        typer.echo(f"Project: {offer.formInfo.projectContract}")
-        typer.echo(f"Investor: {offer.formInfo.investor}")
-        typer.echo(f"Version: {offer.formInfo.version}")
+        typer.echo(f"Project: {offer.formInfo['projectContract']}")
+        typer.echo(f"Investor: {offer.formInfo['investor']}")
+        typer.echo(f"Version: {offer.formInfo['version']}")
     except Exception as e:
         typer.echo(f"L Invalid offer file: {str(e)}", err=True)
         raise typer.Exit(1)
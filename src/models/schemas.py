@@ -1,21 +1,27 @@
+from dataclasses import dataclass
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal, Union
+from typing import Annotated, List, Optional, Literal, Union
+from typing_extensions import TypedDict  # pydantic needs this TypedDict before Python 3.12
 from datetime import datetime
 
 # --- Intermediate Extraction Models ---
+# Plain slotted dataclasses - built by our own extractors for every page, never validated
 
-class ExtractedPage(BaseModel):
+@dataclass(slots=True)
+class ExtractedPage:
     page_number: int
     content: str
 
-class ExtractedFile(BaseModel):
+@dataclass(slots=True)
+class ExtractedFile:
     filename: str
     extraction_method: Literal['ocr', 'text']
     pages: List[ExtractedPage]
 
 # --- Target Offer Template Models (with Polish comments for AI) ---
+# Sections are TypedDicts - plain dicts validated in one pass, only OfferTemplate is a model
 
-class FormInfo(BaseModel):
+class FormInfo(TypedDict):
     description: str  # Opis sekcji
     documentTitle: str  # Klucz: Tytuł dokumentu
     documentVersion: str  # Klucz: Wersja dokumentu
@@ -28,7 +34,7 @@ class FormInfo(BaseModel):
     offerMode: str  # Klucz: Tryb oferty
     requiredCompletionDate: str  # Klucz: Wymagany termin realizacji
 
-class GeneralData(BaseModel):
+class GeneralData(TypedDict):
     description: str  # Opis sekcji
     connectionPower: str  # Klucz: Moc przyłączeniowa
     maxPowerNcRfg: str  # Klucz: Moc maksymalna NcRfG
@@ -37,7 +43,7 @@ class GeneralData(BaseModel):
     shortCircuitCurrentPcc: str  # Klucz: Prąd zwarciowy w PCC
     otherImportantInfo: str  # Klucz: Inne ważne informacje
 
-class Connection(BaseModel):
+class Connection(TypedDict):
     description: str  # Opis sekcji
     connectionLength: str  # Klucz: Długość przyłącza
     cableSlackGuideline: str  # Klucz: Wytyczna dot. zapasu kabla
@@ -52,7 +58,7 @@ class Connection(BaseModel):
     otherObjectsLimitingLoad: str  # Klucz: Inne obiekty ograniczające obciążalność
     otherConnectionNotes: str  # Klucz: Inne uwagi dot. przyłącza
 
-class Gpo(BaseModel):
+class Gpo(TypedDict):
     description: str  # Opis sekcji
     stationLayoutAndConditions: str  # Klucz: Układ i uwarunkowania stacji
     compensationType: str  # Klucz: Rodzaj kompensacji
@@ -60,7 +66,7 @@ class Gpo(BaseModel):
     switchgearType: str  # Klucz: Typ rozdzielnicy
     otherGpoNotes: str  # Klucz: Inne uwagi dot. GPO
 
-class PowerTransformer(BaseModel):
+class PowerTransformer(TypedDict):
     description: str  # Opis sekcji
     minPower: str  # Klucz: Moc minimalna
     requiredShortCircuitVoltage: str  # Klucz: Wymagane napięcie zwarcia
@@ -74,7 +80,7 @@ class PowerTransformer(BaseModel):
     noLoadCurrent: str  # Klucz: Prąd stanu jałowego
     otherTransformerNotes: str  # Klucz: Inne uwagi dot. transformatora
 
-class MvSwitchgear(BaseModel):
+class MvSwitchgear(TypedDict):
     description: str  # Opis sekcji
     operatingMaxVoltage: str  # Klucz: Napięcie robocze maksymalne
     shortCircuitStrengthAndTime: str  # Klucz: Wytrzymałość zwarciowa i czas
@@ -85,7 +91,7 @@ class MvSwitchgear(BaseModel):
     recommendedSolutions: str  # Klucz: Rekomendowane rozwiązania
     otherSwitchgearNotes: str  # Klucz: Inne uwagi dot. rozdzielnicy
 
-class MvTopology(BaseModel):
+class MvTopology(TypedDict):
     description: str  # Opis sekcji
     minConductorCrossSection: str  # Klucz: Minimalny przekrój żyły roboczej
     maxConductorCrossSection: str  # Klucz: Maksymalny przekrój żyły roboczej
@@ -99,7 +105,7 @@ class MvTopology(BaseModel):
     returnConductorShortCircuitStrength: str  # Klucz: Wytrzymałość zwarciowa żyły powrotnej
     otherTopologyNotes: str  # Klucz: Inne uwagi dot. topologii SN
 
-class PvGeneration(BaseModel):
+class PvGeneration(TypedDict):
     description: str  # Opis sekcji
     inverterTypeAndCount: str  # Klucz: Typ i liczba falowników
     panelTypeAndCount: str  # Klucz: Typ i liczba paneli
@@ -119,7 +125,7 @@ class PvGeneration(BaseModel):
     preferredDcAcRatio: str  # Klucz: Preferowany współczynnik DC/AC
     otherPvGenerationNotes: str  # Klucz: Inne uwagi dot. generacji PV
 
-class WindGeneration(BaseModel):
+class WindGeneration(TypedDict):
     description: str  # Opis sekcji
     turbineTypeAndCount: str  # Klucz: Typ i liczba turbin
     fwTopologyDrawingFile: str  # Klucz: Plik z rysunkiem topologii FW
@@ -130,13 +136,13 @@ class WindGeneration(BaseModel):
     maxMvCrossSectionToTurbine: str  # Klucz: Maksymalny przekrój SN do turbiny
     otherWindGenerationNotes: str  # Klucz: Inne uwagi dot. generacji FW
 
-class OtherAtypicalRequirements(BaseModel):
+class OtherAtypicalRequirements(TypedDict):
     description: str  # Opis sekcji
     preferredManufacturers: str  # Klucz: Preferowani producenci
     otherNotes: str  # Klucz: Inne uwagi
 
-class InternalMvCable(BaseModel):
-    from_loc: str = Field(..., alias='from')  # Kolumna w tabeli: od
+class InternalMvCable(TypedDict):
+    from_loc: Annotated[str, Field(alias='from')]  # Kolumna w tabeli: od
     to: str  # Kolumna w tabeli: do
     routeLengthKm: float  # Kolumna w tabeli: [km]
     inverterCount: int  # Kolumna w tabeli: Liczba falowników na stację
@@ -146,7 +152,7 @@ class InternalMvCable(BaseModel):
     returnCrossSectionMm2: int  # Kolumna w tabeli: mm2 (Spowrt)
     coresPerPhase: int  # Kolumna w tabeli: szt.
 
-class RequiredScope(BaseModel):
+class RequiredScope(TypedDict):
     description: str  # Opis sekcji
     tableLengthRequest: str  # Klucz: Wniosek dot. długości stołów
     mvLvStationQuantityCheck: str  # Klucz: Sprawdzenie ilości stacji SN/nn
@@ -166,7 +172,7 @@ class RequiredScope(BaseModel):
     inverterQuantityCheckNew: str  # Klucz: Sprawdzenie ilości falowników (nowe)
     reactivePowerRegulationNote: str  # Klucz: Uwaga dot. regulacji mocy biernej
 
-class Selections(BaseModel):
+class Selections(TypedDict):
     description: str  # Opis sekcji
     selectionA: str  # Klucz: Dobór A
     selectionB: str  # Klucz: Dobór B
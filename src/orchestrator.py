@@ -1,13 +1,22 @@
-import json
+import ast
+import io
 import logging
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Tuple
 from datetime import datetime
 import pydantic
+from pydantic import TypeAdapter
 from dotenv import load_dotenv
+import orjson
 
-from .components.pdf_processor import PDFProcessor
-from .components.llm_clients import LLMClientFactory
+from .components.pdf_processor import PDFProcessor, extract_in_worker, init_extraction_worker
+from .components.llm_clients import DOCUMENTS_HEADER, LLMClientFactory
+from .components.result_handler import Cache
 from .models.schemas import (
     ExtractedFile, 
     OfferTemplate, 
@@ -17,60 +26,122 @@ from .models.schemas import (
 
 logger = logging.getLogger(__name__)
 
+# Built once and reused for every LLM response
+_OFFER_ADAPTER = TypeAdapter(OfferTemplate)
+
+# Model reported in the result for each LLM provider
+_MODEL_MAP = {
+    "openai": "gpt-4-turbo",
+    "claude": "claude-3-opus-20240229",
+    "gemini": "gemini-pro"
+}
+
+@lru_cache(maxsize=1)
+def _load_prompt_template() -> str:
+    """Read the prompt template once per process"""
+    prompt_template_path = Path(__file__).parent.parent / "config" / "prompt_template.md"
+    return prompt_template_path.read_text(encoding='utf-8')
+
+
+def _build_schema_section() -> str:
+    """Source of the OfferTemplate classes with their Polish comments, for the prompt"""
+    # Taken from the source code rather than the JSON schema to preserve the comments
+    schemas_content = (Path(__file__).parent / "models" / "schemas.py").read_text(encoding='utf-8')
+    classes = [node for node in ast.parse(schemas_content).body if isinstance(node, ast.ClassDef)]
+    names = [node.name for node in classes]
+    targets = classes[names.index("FormInfo"):names.index("OfferTemplate") + 1]
+    
+    # Whole lines, so the comment after each class's last field is kept
+    lines = schemas_content.splitlines()
+    sections = ["\n".join(lines[node.lineno - 1:node.end_lineno]) for node in targets]
+    
+    imports = """from pydantic import BaseModel, Field
+from typing import Annotated, List
+from typing_extensions import TypedDict"""
+    
+    return "\n\n".join([imports] + sections)
+
+
+# Parsed once at import - the schemas don't change while the process runs
+_SCHEMA_SECTION = _build_schema_section()
+
 
 class WorkflowOrchestrator:
     def __init__(self, config=None):
         """Initialize the workflow orchestrator"""
         self.config = config or {}
-        self.pdf_processor = PDFProcessor()
         load_dotenv()  # Load environment variables
         
+        # Reuse extraction and LLM results across runs when a cache folder is configured
+        cache_dir = self.config.get('cache_dir') or os.getenv("OFFER_CACHE_DIR")
+        self.cache = Cache(cache_dir) if cache_dir else None
+        self.pdf_processor = PDFProcessor(cache=self.cache)
+        
     def run(self, input_folder: str, output_folder: str, extraction_method: str, llm_provider: str):
         """Main application logic as described in PRD Section 3"""
         logger.info(f"Starting workflow: input={input_folder}, output={output_folder}, method={extraction_method}, llm={llm_provider}")
         
+        # Intermediate JSON is written in the background, behind extraction and the LLM call
+        save_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="save")
+        pending_saves = []
+        
         try:
             # F-01: List all PDF files in input folder
             input_path = Path(input_folder)
             if not input_path.exists():
                 raise FileNotFoundError(f"Input folder not found: {input_folder}")
             
-            pdf_files = list(input_path.glob("*.pdf"))
+            # Case-insensitive, so *.PDF files are found too; sorted for a reproducible prompt order
+            with os.scandir(input_path) as entries:
+                pdf_files = sorted(
+                    (Path(entry.path) for entry in entries if entry.is_file() and entry.name.lower().endswith('.pdf')),
+                    key=lambda pdf_file: pdf_file.name
+                )
             if not pdf_files:
                 logger.warning(f"No PDF files found in {input_folder}")
                 return
             
             logger.info(f"Found {len(pdf_files)} PDF files to process")
             
+            # E.g. a.pdf and a.PDF would both be saved as a_extracted.json - those keep their extension
+            stem_counts = Counter(pdf_file.stem for pdf_file in pdf_files)
+            duplicate_stems = {stem for stem, count in stem_counts.items() if count > 1}
+            if duplicate_stems:
+                logger.warning(f"PDF files differ only in extension: {', '.join(sorted(duplicate_stems))}")
+            
+            # Created once here - the save helpers below expect it to exist
+            Path(output_folder).mkdir(parents=True, exist_ok=True)
+            
             # F-02 & F-03: Extract text from each PDF
-            extracted_files = []
-            for pdf_file in pdf_files:
-                logger.info(f"Processing {pdf_file.name}...")
-                extracted_file = self.pdf_processor.extract(str(pdf_file), extraction_method)
-                extracted_files.append(extracted_file)
+            extracted_files = [None] * len(pdf_files)
+            for index, extracted_file in self._extract_files(pdf_files, extraction_method):
+                extracted_files[index] = extracted_file
                 
                 # F-04: Save intermediate JSON for each file
-                self._save_extracted_file(extracted_file, output_folder)
-            
-            # F-05: Aggregate all extracted text
-            consolidated_text = self._consolidate_text(extracted_files)
+                keep_suffix = Path(extracted_file.filename).stem in duplicate_stems
+                pending_saves.append(
+                    save_pool.submit(self._save_extracted_file, extracted_file, output_folder, keep_suffix)
+                )
             
-            # F-06: Construct LLM prompt
-            prompt = self._construct_prompt(consolidated_text)
+            # F-05 & F-06: Aggregate all extracted text into the LLM prompt
+            prompt = self._construct_prompt(extracted_files)
             
             # F-07: Call LLM
-            llm_client = LLMClientFactory.create_client(llm_provider)
+            llm_client = LLMClientFactory.create_client(llm_provider, cache=self.cache)
             source_filenames = [ef.filename for ef in extracted_files]
             
             logger.info(f"Sending consolidated text to {llm_provider} LLM...")
-            llm_response = llm_client.get_structured_offer(prompt)
+            raw_response, offer_template = llm_client.get_structured_offer_raw(prompt)
+            llm_response = raw_response.decode('utf-8')
             
-            # F-08: Parse and validate response
-            offer_template = OfferTemplate.model_validate(llm_response)
+            # F-08: The client validated the response; only an invalid one is left to report here
+            if offer_template is None:
+                offer_template = _OFFER_ADAPTER.validate_json(raw_response)
             
             # F-09: Create final result
-            final_result = FinalResult(
-                request_details=LLMRequest(
+            # The offer was just validated and the rest is built here - skip re-validating the tree
+            final_result = FinalResult.model_construct(
+                request_details=LLMRequest.model_construct(
                     prompt_sent=prompt,
                     llm_provider=llm_provider,
                     llm_model=self._get_model_name(llm_provider),
@@ -84,6 +155,10 @@ class WorkflowOrchestrator:
             # F-10: Save final result
             self._save_final_result(final_result, output_folder)
             
+            # Surface any error from the background saves
+            for future in pending_saves:
+                future.result()
+            
             logger.info("Workflow completed successfully")
             
         except FileNotFoundError as e:
@@ -92,120 +167,109 @@ class WorkflowOrchestrator:
         except pydantic.ValidationError as e:
             logger.error(f"LLM response validation failed: {str(e)}")
             # Save failed response for debugging
-            self._save_failed_response(llm_response if 'llm_response' in locals() else None, output_folder)
+            self._save_failed_response(raw_response if 'raw_response' in locals() else None, output_folder)
             raise
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
             raise
+        finally:
+            save_pool.shutdown(wait=True)
+    
+    def _extract_files(self, pdf_files: List[Path], extraction_method: str) -> Iterator[Tuple[int, ExtractedFile]]:
+        """F-02 & F-03: Extract PDFs as (index, file) pairs in completion order, in parallel worker processes when there are several"""
+        max_workers = self.config.get('max_workers')
+        if max_workers is None:
+            # Starting worker processes only pays off for OCR - the text layer is read in milliseconds
+            max_workers = (os.cpu_count() or 1) if extraction_method == 'ocr' else 1
+        max_workers = min(len(pdf_files), max_workers)
+        
+        if max_workers <= 1:
+            for index, pdf_file in enumerate(pdf_files):
+                logger.info(f"Processing {pdf_file.name}...")
+                yield index, self.pdf_processor.extract(str(pdf_file), extraction_method)
+            return
+        
+        logger.info(f"Processing {len(pdf_files)} files in {max_workers} worker processes...")
+        cache_dir = str(self.cache.cache_dir) if self.cache else None
+        ocr_concurrency = max(1, (os.cpu_count() or 1) // max_workers)
+        
+        # Spawned workers start clean instead of inheriting forked PyMuPDF state.
+        # The worker entry points live in pdf_processor so workers don't import the LLM SDKs.
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_extraction_worker,
+            initargs=(cache_dir, ocr_concurrency)
+        ) as executor:
+            futures = {
+                executor.submit(extract_in_worker, str(pdf_file), extraction_method): index
+                for index, pdf_file in enumerate(pdf_files)
+            }
+            # A slow file doesn't hold back saving the ones that finished after it
+            for future in as_completed(futures):
+                yield futures[future], future.result()
     
-    def _save_extracted_file(self, extracted_file: ExtractedFile, output_folder: str):
+    def _save_extracted_file(self, extracted_file: ExtractedFile, output_folder: str, keep_suffix: bool = False):
         """F-04: Save intermediate extracted data"""
         output_path = Path(output_folder)
-        output_path.mkdir(parents=True, exist_ok=True)
-        
-        filename = f"{Path(extracted_file.filename).stem}_extracted.json"
+        source_path = Path(extracted_file.filename)
+        filename = f"{source_path.name if keep_suffix else source_path.stem}_extracted.json"
         file_path = output_path / filename
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(extracted_file.model_dump(), f, ensure_ascii=False, indent=2)
+        file_path.write_bytes(orjson.dumps(extracted_file, option=orjson.OPT_INDENT_2))
         
         logger.debug(f"Saved extracted data to {file_path}")
     
-    def _consolidate_text(self, extracted_files: List[ExtractedFile]) -> str:
-        """F-05: Consolidate all extracted text as per PRD pseudocode"""
+    def _consolidate_text_iter(self, extracted_files: List[ExtractedFile]) -> Iterator[str]:
+        """F-05: Yield all extracted text as per PRD pseudocode, fragment by fragment"""
         page_separator = "\n\n--- PAGE BREAK ---\n\n"
         file_separator = "\n\n--- NEW FILE: {filename} ---\n\n"
-        consolidated_text = ""
         
         for extracted_file in extracted_files:
-            consolidated_text += file_separator.format(filename=extracted_file.filename)
-            page_contents = [page.content for page in extracted_file.pages]
-            consolidated_text += page_separator.join(page_contents)
-        
-        return consolidated_text
+            yield file_separator.format(filename=extracted_file.filename)
+            for page_num, page in enumerate(extracted_file.pages):
+                if page_num:
+                    yield page_separator
+                yield page.content
     
-    def _construct_prompt(self, consolidated_text: str) -> str:
+    def _construct_prompt(self, extracted_files: List[ExtractedFile]) -> str:
         """F-06: Construct the final prompt"""
-        # Load prompt template
-        prompt_template_path = Path(__file__).parent.parent / "config" / "prompt_template.md"
-        with open(prompt_template_path, 'r', encoding='utf-8') as f:
-            prompt_template = f.read()
-        
-        # Get the OfferTemplate schema as string with Polish comments
-        # We'll extract this from the source code to preserve comments
-        schemas_path = Path(__file__).parent / "models" / "schemas.py"
-        with open(schemas_path, 'r', encoding='utf-8') as f:
-            schemas_content = f.read()
-        
-        # Extract just the OfferTemplate and related classes with comments
-        # This is a simplified approach - in production you might want a more robust parser
-        schema_section = self._extract_schema_section(schemas_content)
-        
-        # Construct final prompt
-        prompt = f"{prompt_template}\n\n"
-        prompt += "JSON Schema (as Pydantic Model):\n```python\n"
-        prompt += schema_section
-        prompt += "\n```\n\n"
-        prompt += f"OCR Text:\n{consolidated_text}"
-        
-        return prompt
-    
-    def _extract_schema_section(self, schemas_content: str) -> str:
-        """Extract relevant schema classes with Polish comments"""
-        # Find the start of target models
-        start_marker = "# --- Target Offer Template Models"
-        end_marker = "# --- Final Result Model"
-        
-        start_idx = schemas_content.find(start_marker)
-        end_idx = schemas_content.find(end_marker)
+        # Write everything into one buffer - no separate copy of the consolidated text
+        prompt = io.StringIO()
+        prompt.write(f"{_load_prompt_template()}\n\n")
+        prompt.write("JSON Schema (as Pydantic Model):\n```python\n")
+        prompt.write(_SCHEMA_SECTION)
+        prompt.write("\n```\n\n")
+        prompt.write(DOCUMENTS_HEADER)
+        prompt.writelines(self._consolidate_text_iter(extracted_files))
         
-        if start_idx == -1 or end_idx == -1:
-            # Fallback: include everything from FormInfo to OfferTemplate
-            return schemas_content
-        
-        # Extract the relevant section
-        relevant_section = schemas_content[start_idx:end_idx].strip()
-        
-        # Also need to include imports
-        imports = """from pydantic import BaseModel, Field
-from typing import List"""
-        
-        return f"{imports}\n\n{relevant_section}"
+        return prompt.getvalue()
     
     def _get_model_name(self, llm_provider: str) -> str:
         """Get the model name for the LLM provider"""
-        model_map = {
-            "openai": "gpt-4-turbo",
-            "claude": "claude-3-opus-20240229",
-            "gemini": "gemini-pro"
-        }
-        return model_map.get(llm_provider, "unknown")
+        return _MODEL_MAP.get(llm_provider, "unknown")
     
     def _save_final_result(self, final_result: FinalResult, output_folder: str):
         """F-10: Save the final result"""
         output_path = Path(output_folder)
-        output_path.mkdir(parents=True, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Name the files after the timestamp recorded in the result
+        timestamp = final_result.processing_timestamp.strftime("%Y%m%d_%H%M%S")
         filename = f"filled_offer_{timestamp}.json"
         file_path = output_path / filename
         
         # Save just the filled offer as per PRD
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(final_result.filled_offer.model_dump(), f, ensure_ascii=False, indent=2)
+        file_path.write_bytes(_OFFER_ADAPTER.dump_json(final_result.filled_offer, indent=2))
         
         logger.info(f"Saved filled offer to {file_path}")
         
-        # Also save complete result for debugging (optional)
-        debug_filename = f"complete_result_{timestamp}.json"
-        debug_path = output_path / debug_filename
-        with open(debug_path, 'w', encoding='utf-8') as f:
-            # Convert datetime to string for JSON serialization
-            result_dict = final_result.model_dump()
-            result_dict['processing_timestamp'] = final_result.processing_timestamp.isoformat()
-            json.dump(result_dict, f, ensure_ascii=False, indent=2)
-        
-        logger.debug(f"Saved complete result to {debug_path}")
+        # Also save complete result for debugging (optional) - it repeats the offer and the raw response
+        if self.config.get('debug_dump', False):
+            debug_filename = f"complete_result_{timestamp}.json"
+            debug_path = output_path / debug_filename
+            # Pydantic writes processing_timestamp as an ISO 8601 string
+            debug_path.write_bytes(final_result.model_dump_json(indent=2).encode('utf-8'))
+            
+            logger.debug(f"Saved complete result to {debug_path}")
     
     def _save_failed_response(self, response: any, output_folder: str):
         """Save failed LLM response for debugging"""
@@ -213,16 +277,16 @@ from typing import List"""
             return
         
         output_path = Path(output_folder)
-        output_path.mkdir(parents=True, exist_ok=True)
-        
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"failed_response_{timestamp}.json"
-        file_path = output_path / filename
+        file_path = output_path / f"failed_response_{timestamp}.json"
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            if isinstance(response, dict):
-                json.dump(response, f, ensure_ascii=False, indent=2)
-            else:
-                json.dump({"raw_response": str(response)}, f, ensure_ascii=False, indent=2)
+        # Raw replies go to disk as they are - they may not even be valid JSON
+        if isinstance(response, (str, bytes)):
+            file_path = file_path.with_suffix('.txt')
+            file_path.write_bytes(response.encode('utf-8') if isinstance(response, str) else response)
+        elif isinstance(response, dict):
+            file_path.write_bytes(orjson.dumps(response, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            file_path.write_bytes(orjson.dumps({"raw_response": repr(response)}, option=orjson.OPT_INDENT_2))
         
         logger.info(f"Saved failed response to {file_path}")
\ No newline at end of file